@@ -22,18 +22,25 @@ def main():
     print(f"Generating timelapse for: {args.place}")
     print(f"Duration: {args.years} years")
 
-    # Geocoding
+    # Geocoding (cached on disk to skip repeat Nominatim lookups)
+    from src.cache import get_location, set_location
     try:
-        from geopy.geocoders import Nominatim
-        geolocator = Nominatim(user_agent="earth-time-lapse-tool")
-        location = geolocator.geocode(args.place)
+        cached = get_location(args.place)
+        if cached:
+            lat, lon, address = cached
+        else:
+            from geopy.geocoders import Nominatim
+            geolocator = Nominatim(user_agent="earth-time-lapse-tool")
+            location = geolocator.geocode(args.place)
+            
+            if not location:
+                 print(f"Error: Could not find location '{args.place}'.")
+                 return
+            
+            lat, lon, address = location.latitude, location.longitude, location.address
+            set_location(args.place, lat, lon, address)
         
-        if not location:
-             print(f"Error: Could not find location '{args.place}'.")
-             return
-        
-        lat, lon = location.latitude, location.longitude
-        print(f"Found location: {location.address} ({lat}, {lon})")
+        print(f"Found location: {address} ({lat}, {lon})")
         
     except ImportError:
         print("Error: 'geopy' library not found. Please pip install geopy.")
@@ -48,10 +55,23 @@ def main():
     end_year = current_year
     start_year = current_year - args.years
     
-    # Generate Timelapse
+    # Serve repeat runs from the cache before importing Earth Engine at all
+    from src.cache import timelapse_key, restore_timelapse
+    from src.video import output_paths, make_mp4
+    out_gif, out_mp4 = output_paths(args.place, args.output)
+    cache_key = timelapse_key(lat, lon, start_year, end_year, args.place, args.radius, args.frequency, args.width, args.fps, args.vertical)
+    try:
+        if restore_timelapse(cache_key, out_gif):
+            make_mp4(out_gif, out_mp4)
+            return
+    except Exception as e:
+        print(f"Failed to generate timelapse: {e}")
+        return
+
+    # Generate Timelapse (the cache was already checked above)
     from src.timelapse import generate_timelapse
     try:
-        generate_timelapse(lat, lon, start_year, end_year, args.place, args.output, args.project, args.radius, args.frequency, args.width, args.fps, args.vertical)
+        generate_timelapse(lat, lon, start_year, end_year, args.place, args.output, args.project, args.radius, args.frequency, args.width, args.fps, args.vertical, check_cache=False)
     except Exception as e:
         print(f"Failed to generate timelapse: {e}")
     
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import datetime
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'earth-time-lapse'
+)
+GEO_CACHE = os.path.join(CACHE_DIR, 'geo.json')
+
+# Timelapses that reach the current year still gain imagery as new scenes are
+# acquired, so they are only reused for this long.
+OPEN_RANGE_TTL = 7 * 86400
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _place_key(place):
+    return place.strip().lower()
+
+def get_location(place):
+    """
+    Returns the cached (lat, lon, address) for a place name, or None on a miss.
+    """
+    entry = _load_json(GEO_CACHE).get(_place_key(place))
+    if not entry:
+        return None
+    return entry['lat'], entry['lon'], entry['address']
+
+def set_location(place, lat, lon, address):
+    """
+    Stores a geocoding result so repeat runs skip the Nominatim round-trip.
+    """
+    entries = _load_json(GEO_CACHE)
+    entries[_place_key(place)] = {'lat': lat, 'lon': lon, 'address': address}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(GEO_CACHE, 'w') as f:
+            json.dump(entries, f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write geocoding cache: {e}")
+
+def timelapse_key(lat, lon, start_year, end_year, place_name, radius, frequency, width, fps, vertical):
+    """
+    Content-addresses a rendered timelapse by every parameter that affects its pixels.
+    """
+    raw = f"{lat:.4f}|{lon:.4f}|{start_year}|{end_year}|{place_name}|{radius}|{frequency}|{width}|{fps}|{vertical}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def get_timelapse(key):
+    """
+    Returns the path of a cached timelapse GIF, or None on a miss or if it has expired.
+    """
+    gif_path = os.path.join(CACHE_DIR, key + '.gif')
+    json_path = os.path.join(CACHE_DIR, key + '.json')
+    if not (os.path.exists(gif_path) and os.path.exists(json_path)):
+        return None
+    expires = _load_json(json_path).get('expires')
+    if expires is not None and time.time() > expires:
+        return None
+    return gif_path
+
+def restore_timelapse(key, out_gif):
+    """
+    Copies a cached timelapse to out_gif. Returns False on a miss.
+    """
+    cached = get_timelapse(key)
+    if not cached:
+        return False
+    print("Using cached timelapse.")
+    shutil.copy(cached, out_gif)
+    print(f"Timelapse saved to: {out_gif}")
+    return True
+
+def set_timelapse(key, gif_path, end_year):
+    """
+    Copies a finished GIF into the cache. Entries whose range reaches the
+    current year expire after OPEN_RANGE_TTL; closed ranges never change.
+    """
+    expires = None
+    if end_year >= datetime.datetime.now().year:
+        expires = time.time() + OPEN_RANGE_TTL
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        shutil.copy(gif_path, os.path.join(CACHE_DIR, key + '.gif'))
+        with open(os.path.join(CACHE_DIR, key + '.json'), 'w') as f:
+            json.dump({'expires': expires}, f)
+    except OSError as e:
+        print(f"Warning: Could not write timelapse cache: {e}")
@@ -0,0 +1,111 @@
+import os
+import functools
+from collections import deque
+from PIL import Image, ImageDraw, ImageFont
+
+# Kept free of Earth Engine imports: worker processes import this module to
+# render frames, and should not pay for loading geemap/ee.
+
+# Lookup table for blending black at alpha 100/255 over a colour channel
+SHADE_LUT = [v * (255 - 100) // 255 for v in range(256)]
+
+# padding
+PAD = 20
+TEXT_FILL = (255, 255, 255)
+
+@functools.lru_cache(maxsize=None)
+def load_fonts(h):
+    """
+    Returns (font_year, font_loc) sized for frames of height h.
+    Cached, so each process loads the fonts once.
+    """
+    try:
+        font_size_year = int(h * 0.05)
+        font_size_loc = int(h * 0.03)
+
+        # Try loading system fonts
+        font_path = "/System/Library/Fonts/Supplemental/Arial Bold.ttf"
+        if not os.path.exists(font_path):
+             font_path = "/System/Library/Fonts/Helvetica.ttc"
+
+        if os.path.exists(font_path):
+            return ImageFont.truetype(font_path, font_size_year), ImageFont.truetype(font_path, font_size_loc)
+    except:
+        pass
+    return ImageFont.load_default(), ImageFont.load_default()
+
+@functools.lru_cache(maxsize=None)
+def location_layout(text_loc, h):
+    """
+    Returns ((x, y), background box) for the location label, which is
+    identical on every frame.
+    """
+    bbox = load_fonts(h)[1].getbbox(text_loc)
+    loc_w = bbox[2] - bbox[0]
+    loc_h = bbox[3] - bbox[1]
+
+    x_loc = PAD
+    y_loc = h - loc_h - PAD - 10 # extra bottom margin
+    return (x_loc, y_loc), [x_loc - 10, y_loc - 5, x_loc + loc_w + 10, y_loc + loc_h + 5]
+
+def shade_box(frame, box):
+    """
+    Darkens a rectangle of an RGB frame as if overlaid with semi-transparent black.
+    Only the pixels inside the box are read and written.
+    """
+    w, h = frame.size
+    box = (max(0, int(box[0])), max(0, int(box[1])), min(w, int(box[2])), min(h, int(box[3])))
+    region = frame.crop(box)
+    frame.paste(region.point(SHADE_LUT * 3), box)
+
+def render_frame(job):
+    """
+    Draws the date (top-right) and location (bottom-left) labels onto one frame.
+    The job names the frame's image file rather than carrying its pixels, so
+    only a path goes to a worker process; the RGB pixel bytes come back.
+    """
+    path, text_year, text_loc = job
+    with Image.open(path) as im:
+        frame = im.convert("RGB")
+    w, h = frame.size
+    font_year, font_loc = load_fonts(h)
+
+    # One drawing context per frame serves both labels
+    draw = ImageDraw.Draw(frame)
+
+    # 1. Year (Top-Right)
+    if text_year:
+        bbox = font_year.getbbox(text_year)
+        text_w = bbox[2] - bbox[0]
+        text_h = bbox[3] - bbox[1]
+
+        x_year = w - text_w - PAD
+        y_year = PAD
+
+        # Background (Semi-transparent black)
+        shade_box(frame, [x_year - 10, y_year - 5, x_year + text_w + 10, y_year + text_h + 5])
+
+        # Draw Text
+        draw.text((x_year, y_year), text_year, font=font_year, fill=TEXT_FILL)
+
+    # 2. Location (Bottom-Left)
+    if text_loc:
+        xy_loc, loc_box = location_layout(text_loc, h)
+        shade_box(frame, loc_box)
+        draw.text(xy_loc, text_loc, font=font_loc, fill=TEXT_FILL)
+
+    return frame.tobytes()
+
+def bounded_map(executor, func, items, max_in_flight):
+    """
+    Like executor.map, but pulls from `items` lazily and keeps at most
+    max_in_flight jobs pending, so a long input is never fully materialised.
+    Results are yielded in input order.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -1,20 +1,62 @@
 import geemap
 import ee
 import os
+import math
+import time
+import random
 import shutil
-from PIL import Image, ImageDraw, ImageFont
+import tempfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image
+from src.cache import timelapse_key, restore_timelapse, set_timelapse
+from src.video import output_paths, start_mp4_encoder, finish_mp4_encoder, make_mp4
+from src.overlay import render_frame, bounded_map, SHADE_LUT
 
-def generate_timelapse(lat, lon, start_year, end_year, place_name, output_filename, project_id=None, radius=10000, frequency='year', width=768, fps=10, vertical=False):
+# Endpoint tuned for many concurrent small requests (per-frame thumbnails)
+HIGH_VOLUME_URL = 'https://earthengine-highvolume.googleapis.com'
+DOWNLOAD_WORKERS = 25
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 60 # seconds
+
+# Overlay cost model, measured per pixel on 720x1280 frames: drawing a frame,
+# quantising it to the shared palette (always done in the main process) and
+# returning its pixels from a worker process; plus one worker's start-up time.
+RENDER_NS_PER_PIXEL = 16
+QUANTIZE_NS_PER_PIXEL = 17
+TRANSFER_NS_PER_PIXEL = 9
+WORKER_STARTUP_S = 0.12
+
+# Frames sampled across the series to build the shared GIF palette
+PALETTE_SAMPLES = 8
+
+# Moving-median radius, in frames on each side of the current one. The join
+# windows are symmetric: year uses {t-1, t, t+1} and month t-2..t+2, where the
+# original filterDate windows were {t-1, t} and t-2..t+1.
+SMOOTHING_RADIUS = {'year': 1, 'quarter': 1, 'month': 2}
+# Average spacing between consecutive composites, in milliseconds
+PERIOD_MS = {'year': 365.25 * 86400000, 'quarter': 91.3125 * 86400000, 'month': 30.4375 * 86400000}
+
+# Metres per degree of latitude (small-angle approximation)
+METERS_PER_DEGREE = 111320.0
+
+# Set once Earth Engine is initialised, so batch runs authenticate only once
+_EE_INITIALIZED = False
+
+def initialize_ee(project_id=None):
     """
-    Generates a satellite timelapse for the given coordinates and time range.
-    Applies temporal smoothing to reduce flickering.
+    Initialises Earth Engine on first use; later calls are no-ops.
     """
+    global _EE_INITIALIZED
+    if _EE_INITIALIZED:
+        return
+
     try:
-        # Initialize Earth Engine
         if project_id:
-            ee.Initialize(project=project_id)
+            ee.Initialize(project=project_id, opt_url=HIGH_VOLUME_URL)
         else:
-            ee.Initialize()
+            ee.Initialize(opt_url=HIGH_VOLUME_URL)
         print("Earth Engine initialized successfully.")
     except Exception as e:
         if "no project found" in str(e).lower():
@@ -26,6 +68,25 @@ def generate_timelapse(lat, lon, start_year, end_year, place_name, output_filena
              print("Please ensure you are authenticated by running 'earthengine authenticate'.")
         raise e
 
+    _EE_INITIALIZED = True
+
+def generate_timelapse(lat, lon, start_year, end_year, place_name, output_filename, project_id=None, radius=10000, frequency='year', width=768, fps=10, vertical=False, check_cache=True):
+    """
+    Generates a satellite timelapse for the given coordinates and time range.
+    Applies temporal smoothing to reduce flickering.
+    Results are cached on disk, so identical re-runs skip Earth Engine entirely;
+    pass check_cache=False if the caller has already looked the run up.
+    """
+    out_gif, out_mp4 = output_paths(place_name, output_filename)
+
+    cache_key = timelapse_key(lat, lon, start_year, end_year, place_name, radius, frequency, width, fps, vertical)
+    if check_cache and restore_timelapse(cache_key, out_gif):
+        make_mp4(out_gif, out_mp4)
+        return out_gif
+
+    # Initialize Earth Engine
+    initialize_ee(project_id)
+
     # Define the Region of Interest (ROI)
     point = ee.Geometry.Point([lon, lat])
     
@@ -35,15 +96,12 @@ def generate_timelapse(lat, lon, start_year, end_year, place_name, output_filena
         # Vertical ratio 9:16 - Adjust width/height to match coverage
         height_radius = radius * (16/9)
         
-        # Calculate bounds for vertical ROI
+        # Calculate bounds for vertical ROI locally (no server round-trips)
         try:
-            poly_w = point.buffer(radius).bounds().getInfo()['coordinates'][0]
-            poly_h = point.buffer(height_radius).bounds().getInfo()['coordinates'][0]
-            
-            lons = [p[0] for p in poly_w]
-            lats = [p[1] for p in poly_h]
+            dlat = height_radius / METERS_PER_DEGREE
+            dlon = radius / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
             
-            roi = ee.Geometry.Rectangle([min(lons), min(lats), max(lons), max(lats)])
+            roi = ee.Geometry.Rectangle([lon - dlon, lat - dlat, lon + dlon, lat + dlat])
             video_dims = [720, 1280] # 720p Vertical (Safe for EE limits)
         except Exception as e:
             print(f"Error calculating vertical ROI: {e}. Falling back to standard.")
@@ -65,192 +123,267 @@ def generate_timelapse(lat, lon, start_year, end_year, place_name, output_filena
         start_date='01-01',
         end_date='12-31',
         frequency=frequency
-    ).select(['Red', 'Green', 'Blue']).map(lambda img: img.toFloat())
+    ).select(['Red', 'Green', 'Blue'])
 
     # 2. Apply Temporal Smoothing (Moving Median)
-    if frequency == 'year':
-        window_size, unit = 1, 'year'
-    elif frequency == 'quarter':
-        window_size, unit = 4, 'month' # Approx 1 quarter
-    elif frequency == 'month':
-        window_size, unit = 2, 'month'
-    else:
-         window_size, unit = 1, 'year'
-
-    print(f"Applying temporal smoothing (Moving Median) with radius {window_size} {unit}(s)...")
-
-    def smooth_func(image):
-        d = ee.Date(image.get('system:time_start'))
-        start_win = d.advance(-window_size, unit)
-        end_win = d.advance(window_size, unit) 
-        
-        subset = collection.filterDate(start_win, end_win)
-        return subset.median().set('system:time_start', image.get('system:time_start'))
-
-    smoothed_collection = collection.map(smooth_func)
+    smoothed_collection = temporal_median(collection, frequency)
 
     # 3. Visualization configuration
     # Natural color with standard deviation stretch (approx sigma=2)
     vis_params = {"min": 0.0, "max": 0.25, "bands": ['Red', 'Green', 'Blue'], "gamma": 1.2}
 
     # 4. Export Video
-    clean_place = place_name.split(',')[0].strip().replace(' ', '_')
-    if output_filename == "timelapse":
-        output_filename = f"timelapse_{clean_place}"
-    
-    if not output_filename.endswith('.gif'):
-        out_gif, out_mp4 = output_filename + ".gif", output_filename + ".mp4"
-    else:
-        out_gif, out_mp4 = output_filename, output_filename.replace('.gif', '.mp4')
-        
-    print(f"Downloading timelapse video to {out_gif}...")
+    print(f"Downloading timelapse frames for {out_gif}...")
     
     rgb_collection = smoothed_collection.map(lambda img: img.visualize(**vis_params))
 
-    video_args = {
+    if isinstance(video_dims, list):
+        video_dims = f"{video_dims[0]}x{video_dims[1]}"
+
+    thumb_args = {
         'dimensions': video_dims,
         'region': roi,
-        'framesPerSecond': fps,
+        'format': 'png',
         'crs': 'EPSG:3857',
-        'min': 0,
-        'max': 255,
     }
 
-    geemap.download_ee_video(
-        rgb_collection,
-        video_args,
-        out_gif
-    )
+    # landsat_timeseries emits exactly one composite per period, so the frame
+    # labels (and count) follow from the parameters without asking the server.
+    dates = frame_labels(start_year, end_year, frequency)
+    duration = int(1000 / fps)
 
-    # 5. Add Text Overlay (Date & Location)
-    print("Adding aesthetic text overlays...")
-    try:
-        # Get dates
-        dates_ms = collection.aggregate_array('system:time_start').getInfo()
-        import datetime
-        
-        dates = []
-        for ms in dates_ms:
-            if ms is None: 
-                dates.append("")
-                continue
-            dt = datetime.datetime.fromtimestamp(ms / 1000.0, tz=datetime.timezone.utc)
-            if frequency == 'year':
-                dates.append(dt.strftime('%Y'))
-            elif frequency == 'quarter':
-                q = (dt.month - 1) // 3 + 1
-                dates.append(f"{dt.year} Q{q}")
-            else: 
-                dates.append(dt.strftime('%Y-%m'))
-
-        if len(dates) > 0 and os.path.exists(out_gif):
-            # Process GIF frames with PIL
-            with Image.open(out_gif) as im:
-                frames = []
-                # Loop over frames
-                for i in range(im.n_frames):
-                    im.seek(i)
-                    frame = im.convert("RGBA")
-                    
-                    # Prepare drawing
-                    draw = ImageDraw.Draw(frame)
-                    w, h = frame.size
-                    
-                    # Fonts
-                    try:
-                        font_size_year = int(h * 0.05)
-                        font_size_loc = int(h * 0.03)
-                        
-                        # Try loading system fonts
-                        font_path = "/System/Library/Fonts/Supplemental/Arial Bold.ttf"
-                        if not os.path.exists(font_path):
-                             font_path = "/System/Library/Fonts/Helvetica.ttc"
-                        
-                        if os.path.exists(font_path):
-                            font_year = ImageFont.truetype(font_path, font_size_year)
-                            font_loc = ImageFont.truetype(font_path, font_size_loc)
-                        else:
-                            font_year = ImageFont.load_default()
-                            font_loc = ImageFont.load_default()
-                    except:
-                        font_year = ImageFont.load_default()
-                        font_loc = ImageFont.load_default()
-
-                    # Text Content
-                    text_year = dates[i] if i < len(dates) else ""
-                    text_loc = place_name
-                    
-                    # padding
-                    pad = 20
-                    
-                    # 1. Year (Top-Right)
-                    if text_year:
-                        bbox = draw.textbbox((0, 0), text_year, font=font_year)
-                        text_w = bbox[2] - bbox[0]
-                        text_h = bbox[3] - bbox[1]
-                        
-                        x_year = w - text_w - pad
-                        y_year = pad
-                        
-                        # Background (Semi-transparent black)
-                        overlay = Image.new('RGBA', frame.size, (0,0,0,0))
-                        d_over = ImageDraw.Draw(overlay)
-                        d_over.rectangle([x_year - 10, y_year - 5, x_year + text_w + 10, y_year + text_h + 5], fill=(0, 0, 0, 100))
-                        frame = Image.alpha_composite(frame, overlay)
-                        draw = ImageDraw.Draw(frame) # re-init draw on new frame
-                        
-                        # Draw Text
-                        draw.text((x_year, y_year), text_year, font=font_year, fill="white")
-
-                    # 2. Location (Bottom-Left)
-                    if text_loc:
-                        bbox = draw.textbbox((0, 0), text_loc, font=font_loc)
-                        text_w = bbox[2] - bbox[0]
-                        text_h = bbox[3] - bbox[1]
-                        
-                        x_loc = pad
-                        y_loc = h - text_h - pad - 10 # extra bottom margin
-                        
-                        # Background
-                        overlay = Image.new('RGBA', frame.size, (0,0,0,0))
-                        d_over = ImageDraw.Draw(overlay)
-                        d_over.rectangle([x_loc - 10, y_loc - 5, x_loc + text_w + 10, y_loc + text_h + 5], fill=(0, 0, 0, 100))
-                        frame = Image.alpha_composite(frame, overlay)
-                        draw = ImageDraw.Draw(frame)
-                        
-                        draw.text((x_loc, y_loc), text_loc, font=font_loc, fill="white")
-                    
-                    frames.append(frame)
-
-                # Save new GIF
-                frames[0].save(
-                    out_gif,
-                    save_all=True,
-                    append_images=frames[1:],
-                    duration=im.info.get('duration', 100),
-                    loop=0
-                )
+    with tempfile.TemporaryDirectory() as frame_dir:
+        paths = download_frames(rgb_collection, len(dates), thumb_args, frame_dir)
 
-        else:
-            print("Warning: No dates found or output file missing.")
+        # 5. Add Text Overlay (Date & Location)
+        print("Adding aesthetic text overlays...")
+        encoder = None
+        mp4_done = False
+        tmp_gif = out_gif + ".tmp"
+        try:
+            with Image.open(paths[0]) as first:
+                size = first.size
 
-    except Exception as e:
-        print(f"Failed to add text overlay: {e}")
+            # The MP4 is encoded from the same overlaid frames, so the GIF
+            # never has to be decoded again.
+            encoder = start_mp4_encoder(out_mp4, size, fps)
+
+            def frame_jobs():
+                for i, path in enumerate(paths):
+                    yield (path, dates[i], place_name)
+
+            # When it pays off, frames are drawn in worker processes, which
+            # decode them themselves; a bounded window of jobs keeps memory flat.
+            # Otherwise they are drawn in-process, on a background thread that
+            # decodes and draws frame i+1 while frame i is quantised here.
+            def rendered_frames():
+                workers = overlay_workers(len(paths), size)
+                if not workers:
+                    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+                        yield from bounded_map(prefetcher, render_frame, frame_jobs(), 2)
+                    return
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    yield from bounded_map(pool, render_frame, frame_jobs(), 2 * workers)
+
+            def overlay_frames():
+                for frame_bytes in rendered_frames():
+                    if encoder and encoder.poll() is None:
+                        try:
+                            encoder.stdin.write(frame_bytes)
+                        except BrokenPipeError:
+                            pass # ffmpeg exited; reported when the encoder is finished
+                    yield Image.frombytes("RGB", size, frame_bytes)
+
+            frames = quantize_frames(overlay_frames(), build_palette(paths))
+            next(frames).save(
+                tmp_gif,
+                format="GIF",
+                save_all=True,
+                append_images=frames,
+                duration=duration,
+                loop=0,
+                optimize=True
+            )
+            os.replace(tmp_gif, out_gif)
+            set_timelapse(cache_key, out_gif, end_year)
+
+            if encoder:
+                finish_mp4_encoder(encoder, out_mp4)
+                encoder = None
+                mp4_done = True
+
+        except Exception as e:
+            print(f"Failed to add text overlay: {e}")
+            if encoder:
+                encoder.kill()
+                encoder.wait()
+            if os.path.exists(tmp_gif):
+                os.remove(tmp_gif)
+
+            # Fall back to the plain, unlabelled frames
+            frames = (Image.open(path).convert("RGB") for path in paths)
+            next(frames).save(out_gif, save_all=True, append_images=frames, duration=duration, loop=0)
 
     print(f"Timelapse saved to: {out_gif}")
-    
-    # Generate MP4
-    if os.path.exists(out_gif):
-        if shutil.which("ffmpeg"):
-            print("Generating MP4...")
-            cmd = f'ffmpeg -y -i "{out_gif}" -movflags faststart -pix_fmt yuv420p -vf "scale=trunc(iw/2)*2:trunc(ih/2)*2" "{out_mp4}"'
-            result = os.system(cmd)
-            if result == 0:
-                print(f"MP4 saved to: {out_mp4}")
-            else:
-                 print("Failed to generate MP4 (ffmpeg error).")
-        else:
-            print("ffmpeg not found, skipping MP4 generation.")
+    if not mp4_done:
+        make_mp4(out_gif, out_mp4)
 
     return out_gif
-    
+
+def temporal_median(collection, frequency):
+    """
+    Replaces every frame with the median of itself and its neighbours.
+    The neighbourhoods come from one self-join instead of a filterDate per frame.
+    """
+    radius = SMOOTHING_RADIUS.get(frequency, 1)
+    period_ms = PERIOD_MS.get(frequency, PERIOD_MS['year'])
+    print(f"Applying temporal smoothing (Moving Median) with radius {radius} frame(s)...")
+
+    # Half a period of slack keeps calendar jitter (leap years, month lengths)
+    # from dropping or adding a neighbour at the window edge.
+    neighbours = ee.Filter.maxDifference(
+        difference=(radius + 0.5) * period_ms,
+        leftField='system:time_start',
+        rightField='system:time_start'
+    )
+    joined = ee.Join.saveAll(matchesKey='matches').apply(collection, collection, neighbours)
+
+    def smooth_func(image):
+        # Empty periods are int16 placeholders while real composites are float
+        # reflectance; median() needs a single band type across the window.
+        subset = ee.ImageCollection.fromImages(image.get('matches')).map(lambda img: ee.Image(img).toFloat())
+        return subset.median().set('system:time_start', image.get('system:time_start'))
+
+    return ee.ImageCollection(joined).map(smooth_func)
+
+def overlay_workers(n_frames, size):
+    """
+    Returns how many worker processes should draw the overlays, or 0 to draw
+    them in-process. Picks the count with the largest estimated saving.
+    """
+    pixels = n_frames * size[0] * size[1]
+    # In-process, drawing and quantising share the main process (counted as
+    # serial: drawing holds the GIL). With a pool the main process still
+    # quantises and receives every frame, so that bounds its throughput.
+    in_process = pixels * (RENDER_NS_PER_PIXEL + QUANTIZE_NS_PER_PIXEL) * 1e-9
+
+    best, best_time = 0, in_process
+    # One CPU stays with the main process
+    for workers in range(1, min((os.cpu_count() or 1) - 1, n_frames) + 1):
+        per_pixel = max(RENDER_NS_PER_PIXEL / workers, QUANTIZE_NS_PER_PIXEL + TRANSFER_NS_PER_PIXEL)
+        pooled = pixels * per_pixel * 1e-9 + workers * WORKER_STARTUP_S
+        if pooled < best_time:
+            best, best_time = workers, pooled
+    return best
+
+def palette_samples(n_frames):
+    """
+    Picks PALETTE_SAMPLES frame indices: one per equal slice of the series,
+    stepping the position within each slice so consecutive samples land in
+    different phases of any seasonal (quarterly/monthly) cycle.
+    """
+    if n_frames <= PALETTE_SAMPLES:
+        return list(range(n_frames))
+    samples = []
+    for k in range(PALETTE_SAMPLES):
+        lo = k * n_frames // PALETTE_SAMPLES
+        hi = (k + 1) * n_frames // PALETTE_SAMPLES
+        samples.append(lo + k % (hi - lo))
+    return samples
+
+def build_palette(paths):
+    """
+    Builds one adaptive palette from a montage of frames sampled across the series.
+    Blank frames (empty periods render all black) are skipped so they cannot
+    starve the palette; shaded copies and white/black swatches cover the labels.
+    """
+    def load_tile(i):
+        with Image.open(paths[i]) as im:
+            tile = im.convert("RGB")
+        if tile.getbbox() is None:
+            return None
+        tile.thumbnail((256, 256))
+        return tile
+
+    samples = palette_samples(len(paths))
+    tiles = [tile for tile in map(load_tile, samples) if tile]
+    if not tiles:
+        # Every sample was an empty period: scan the rest for real imagery
+        for i in range(len(paths)):
+            if i in samples:
+                continue
+            tile = load_tile(i)
+            if tile:
+                tiles.append(tile)
+                if len(tiles) == PALETTE_SAMPLES:
+                    break
+
+    tiles += [tile.point(SHADE_LUT * 3).resize((tile.width // 2, tile.height // 2)) for tile in tiles]
+    height = max([tile.height for tile in tiles] + [64])
+    tiles += [Image.new("RGB", (32, height), (255, 255, 255)), Image.new("RGB", (32, height), (0, 0, 0))]
+
+    montage = Image.new("RGB", (sum(tile.width for tile in tiles), height))
+    x = 0
+    for tile in tiles:
+        montage.paste(tile, (x, 0))
+        x += tile.width
+    return montage.quantize(colors=256)
+
+def quantize_frames(frames, palette):
+    """
+    Maps RGB frames onto one shared palette image.
+    A shared palette keeps colours stable between frames and lets the GIF
+    encoder store only the pixels that change.
+    """
+    for frame in frames:
+        yield frame.quantize(palette=palette, dither=Image.FLOYDSTEINBERG)
+
+def frame_labels(start_year, end_year, frequency):
+    """
+    Returns the date label of every composite in the time series, in order.
+    """
+    years = range(start_year, end_year + 1)
+    if frequency == 'quarter':
+        return [f"{y} Q{q}" for y in years for q in (1, 2, 3, 4)]
+    elif frequency == 'month':
+        return [f"{y}-{m:02d}" for y in years for m in range(1, 13)]
+    else:
+        return [str(y) for y in years]
+
+def fetch_url(url, path):
+    """
+    Downloads url to path, retrying throttling (429), server errors and
+    network failures with exponential backoff.
+    """
+    for attempt in range(DOWNLOAD_RETRIES):
+        try:
+            with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+            return
+        except urllib.error.HTTPError as e:
+            if (e.code != 429 and e.code < 500) or attempt == DOWNLOAD_RETRIES - 1:
+                raise
+        except OSError: # URLError, timeouts, connection resets
+            if attempt == DOWNLOAD_RETRIES - 1:
+                raise
+        time.sleep(2 ** attempt + random.random())
+
+def download_frames(rgb_collection, n_frames, thumb_args, frame_dir):
+    """
+    Fetches every frame as a PNG thumbnail into frame_dir, in parallel.
+    Returns the PNG paths in frame order.
+    """
+    if n_frames == 0:
+        raise RuntimeError("No frames found for the requested time range.")
+
+    frame_list = rgb_collection.toList(n_frames)
+
+    def fetch_frame(i):
+        path = os.path.join(frame_dir, f"frame_{i:04d}.png")
+        url = ee.Image(frame_list.get(i)).getThumbURL(thumb_args)
+        fetch_url(url, path)
+        return path
+
+    print(f"Fetching {n_frames} frames with {min(DOWNLOAD_WORKERS, n_frames)} parallel requests...")
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, n_frames)) as executor:
+        return list(executor.map(fetch_frame, range(n_frames)))
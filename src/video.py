@@ -0,0 +1,63 @@
+import os
+import shutil
+import subprocess
+
+# Kept free of Earth Engine imports so main.py can serve cached runs quickly.
+
+def output_paths(place_name, output_filename):
+    """
+    Returns the (gif, mp4) output paths for a run.
+    """
+    clean_place = place_name.split(',')[0].strip().replace(' ', '_')
+    if output_filename == "timelapse":
+        output_filename = f"timelapse_{clean_place}"
+    
+    if not output_filename.endswith('.gif'):
+        return output_filename + ".gif", output_filename + ".mp4"
+    else:
+        return output_filename, output_filename.replace('.gif', '.mp4')
+
+# Shared output options: web-friendly H.264 with even dimensions
+MP4_ARGS = ['-movflags', 'faststart', '-pix_fmt', 'yuv420p', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2']
+
+def start_mp4_encoder(out_mp4, size, fps):
+    """
+    Starts an ffmpeg process that encodes raw RGB frames written to its stdin.
+    Returns None if ffmpeg is not installed.
+    """
+    if not shutil.which("ffmpeg"):
+        return None
+    print("Generating MP4...")
+    w, h = size
+    cmd = ['ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{w}x{h}', '-r', str(fps), '-i', '-'] + MP4_ARGS + [out_mp4]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+def finish_mp4_encoder(encoder, out_mp4):
+    """
+    Closes the frame pipe and waits for ffmpeg to finish writing the MP4.
+    """
+    try:
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass
+    if encoder.wait() == 0:
+        print(f"MP4 saved to: {out_mp4}")
+    else:
+        print("Failed to generate MP4 (ffmpeg error).")
+
+def make_mp4(out_gif, out_mp4):
+    """
+    Converts the GIF to an MP4 with ffmpeg, if available.
+    """
+    if os.path.exists(out_gif):
+        if shutil.which("ffmpeg"):
+            print("Generating MP4...")
+            cmd = ['ffmpeg', '-y', '-i', out_gif] + MP4_ARGS + [out_mp4]
+            result = subprocess.run(cmd).returncode
+            if result == 0:
+                print(f"MP4 saved to: {out_mp4}")
+            else:
+                 print("Failed to generate MP4 (ffmpeg error).")
+        else:
+            print("ffmpeg not found, skipping MP4 generation.")
+